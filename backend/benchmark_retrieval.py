@@ -0,0 +1,250 @@
+"""
+Offline retrieval benchmark
+
+Sweeps chunk size, overlap and n_results over a labelled fixture corpus and
+reports, for each setting:
+- recall@k: how often a retrieved chunk contains the labelled answer span
+- index size: chunks and bytes (float32 vectors + text)
+- ingest time: chunking + embedding + storing
+- query latency: mean and p95 per question
+- prompt tokens: rough size of the context we'd send to Claude
+- with --quantized: recall@k of float16/int8 vectors against float32 (see VECTOR_DTYPE)
+
+Fixture format (JSON):
+{
+    "documents": [{"id": "handbook", "path": "fixtures/handbook.pdf"},
+                  {"id": "notes", "text": "...inline text..."}],
+    "questions": [{"doc_id": "handbook", "question": "How many vacation days?",
+                   "answer": "25 days of paid vacation"}]
+}
+"answer" must be copied from the document text (it's matched after collapsing whitespace).
+
+Usage:
+    python benchmark_retrieval.py fixtures.json --chunk-sizes 500,1000,1500 --overlaps 0,100,200 --n-results 3,5,10
+    python benchmark_retrieval.py fixtures.json --per-doc 2,3,5 --n-results 5,10   # collection queries
+    python benchmark_retrieval.py fixtures.json --quantized int8,float16             # compact vectors
+"""
+import argparse
+import json
+import os
+import re
+import statistics
+import time
+from typing import Dict, List
+
+import chromadb
+from chromadb.config import Settings
+
+from embeddings import embedding_model, chunk_text, quantized_recall, CHUNK_SIZE, CHUNK_OVERLAP
+from file_processor import EXTRACTORS
+from rag import RAG_SYSTEM_RULES
+
+
+def normalize(text: str) -> str:
+    return re.sub(r"\s+", " ", text).strip().lower()
+
+
+def load_corpus(fixture_path: str) -> Dict:
+    """Read the fixture file and extract text for every document"""
+    with open(fixture_path) as f:
+        corpus = json.load(f)
+
+    base_dir = os.path.dirname(os.path.abspath(fixture_path))
+    texts = {}
+    for doc in corpus["documents"]:
+        if "text" in doc:
+            texts[doc["id"]] = doc["text"]
+        else:
+            # Fixtures are trusted, so skip the worker pool and call the extractor directly
+            path = os.path.join(base_dir, doc["path"])
+            texts[doc["id"]] = EXTRACTORS[os.path.splitext(path)[1].lower()].func(path)
+
+    for q in corpus["questions"]:
+        if normalize(q["answer"]) not in normalize(texts[q["doc_id"]]):
+            print(f"Warning: answer for '{q['question']}' isn't in document {q['doc_id']}")
+
+    return {"texts": texts, "questions": corpus["questions"]}
+
+
+def build_index(client, texts: Dict[str, str], chunk_size: int, overlap: int) -> Dict:
+    """Chunk, embed and store every document - like create_embeddings, but in memory"""
+    started = time.perf_counter()
+    collections = {}
+    chunk_count = 0
+    index_bytes = 0
+
+    for doc_id, text in texts.items():
+        chunks = chunk_text(text, chunk_size=chunk_size, overlap=overlap)
+        collection = client.create_collection(
+            name=f"bench_{chunk_size}_{overlap}_{len(collections)}",
+            metadata={"hnsw:space": "cosine"}
+        )
+        if chunks:
+            embeddings = embedding_model.encode(chunks).tolist()
+            collection.add(
+                embeddings=embeddings,
+                documents=chunks,
+                ids=[f"{doc_id}_chunk_{i}" for i in range(len(chunks))]
+            )
+            index_bytes += len(embeddings) * len(embeddings[0]) * 4
+            index_bytes += sum(len(chunk.encode("utf-8")) for chunk in chunks)
+        collections[doc_id] = collection
+        chunk_count += len(chunks)
+
+    return {
+        "collections": collections,
+        "chunks": chunk_count,
+        "index_bytes": index_bytes,
+        "ingest_seconds": time.perf_counter() - started
+    }
+
+
+def retrieve(collections: Dict, doc_ids: List[str], question: str, per_doc: int, n_results: int) -> List[str]:
+    """Same strategy as query_with_rag / query_multiple_documents"""
+    query_embedding = embedding_model.encode([question]).tolist()
+    found = []
+    for doc_id in doc_ids:
+        collection = collections[doc_id]
+        if collection.count() == 0:
+            continue
+        results = collection.query(
+            query_embeddings=query_embedding,
+            n_results=min(per_doc, collection.count())
+        )
+        found += list(zip(results['documents'][0], results['distances'][0]))
+
+    found.sort(key=lambda x: x[1])
+    return [chunk for chunk, _ in found[:n_results]]
+
+
+def prompt_tokens(chunks: List[str], question: str) -> int:
+    """Rough token count (~4 characters per token) of the prompt query_with_rag would build"""
+    context = "\n\n".join(f"[Source {i+1}]:\n{chunk}" for i, chunk in enumerate(chunks))
+    return (len(RAG_SYSTEM_RULES) + len(context) + len(question)) // 4
+
+
+def evaluate(index: Dict, corpus: Dict, n_results: int, per_doc: int = None) -> Dict:
+    """
+    Ask every question and check whether the answer span made it into the retrieved chunks
+    per_doc=None searches only the question's document, otherwise every document (collection mode)
+    """
+    all_doc_ids = list(corpus["texts"])
+    hits = 0
+    latencies = []
+    tokens = []
+
+    for q in corpus["questions"]:
+        doc_ids = [q["doc_id"]] if per_doc is None else all_doc_ids
+
+        started = time.perf_counter()
+        chunks = retrieve(index["collections"], doc_ids, q["question"], per_doc or n_results, n_results)
+        latencies.append(time.perf_counter() - started)
+
+        answer = normalize(q["answer"])
+        if any(answer in normalize(chunk) for chunk in chunks):
+            hits += 1
+        tokens.append(prompt_tokens(chunks, q["question"]))
+
+    latencies.sort()
+    return {
+        "recall": hits / len(corpus["questions"]) if corpus["questions"] else 0.0,
+        "latency_ms_mean": statistics.mean(latencies) * 1000 if latencies else 0.0,
+        "latency_ms_p95": latencies[int(0.95 * (len(latencies) - 1))] * 1000 if latencies else 0.0,
+        "prompt_tokens_mean": statistics.mean(tokens) if tokens else 0.0
+    }
+
+
+def evaluate_quantized(index: Dict, corpus: Dict, dtypes: List[str], n_results: int) -> Dict:
+    """
+    recall@k of compact vectors against float32, using each document's own questions
+    Returns {"quantized_recall_int8": ..., ...} averaged over all questions
+    """
+    results = {}
+    for dtype in dtypes:
+        weighted, counted = 0.0, 0
+        for doc_id, collection in index["collections"].items():
+            questions = [q["question"] for q in corpus["questions"] if q["doc_id"] == doc_id]
+            if not questions or collection.count() == 0:
+                continue
+            query_embeddings = embedding_model.encode(questions).tolist()
+            weighted += quantized_recall(collection, query_embeddings, dtype, n_results)["recall"] * len(questions)
+            counted += len(questions)
+        results[f"quantized_recall_{dtype}"] = weighted / counted if counted else 1.0
+    return results
+
+
+def sweep(corpus: Dict, chunk_sizes: List[int], overlaps: List[int],
+          n_results: List[int], per_doc: List[int] = None, quantized: List[str] = None) -> List[Dict]:
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    rows = []
+
+    for chunk_size in chunk_sizes:
+        for overlap in overlaps:
+            # Same rule as CHUNK_OVERLAP in embeddings.py: chunks can end at half their size,
+            # so a bigger overlap would barely move forward each chunk
+            if overlap >= chunk_size // 2:
+                print(f"Skipping chunk_size={chunk_size} overlap={overlap} (overlap must be < chunk_size / 2)")
+                continue
+
+            print(f"Indexing chunk_size={chunk_size} overlap={overlap}...")
+            index = build_index(client, corpus["texts"], chunk_size, overlap)
+
+            for k in n_results:
+                for per in (per_doc or [None]):
+                    rows.append({
+                        "chunk_size": chunk_size,
+                        "overlap": overlap,
+                        "n_results": k,
+                        "per_doc": per,
+                        "chunks": index["chunks"],
+                        "index_bytes": index["index_bytes"],
+                        "ingest_seconds": index["ingest_seconds"],
+                        **evaluate(index, corpus, k, per),
+                        **evaluate_quantized(index, corpus, quantized or [], k)
+                    })
+
+            client.reset()
+
+    return rows
+
+
+def print_table(rows: List[Dict]):
+    quantized_keys = [key for key in (rows[0] if rows else {}) if key.startswith("quantized_recall_")]
+    header = f"{'chunk':>6} {'overlap':>7} {'k':>4} {'per_doc':>7} {'recall':>7} {'chunks':>7} " \
+             f"{'index_kb':>9} {'ingest_s':>9} {'lat_ms':>8} {'p95_ms':>8} {'tokens':>7}" + \
+             "".join(f" {key.replace('quantized_recall_', 'vs_f32_'):>12}" for key in quantized_keys)
+    print(header)
+    print("-" * len(header))
+    for row in rows:
+        print(f"{row['chunk_size']:>6} {row['overlap']:>7} {row['n_results']:>4} {str(row['per_doc'] or '-'):>7} "
+              f"{row['recall']:>7.2f} {row['chunks']:>7} {row['index_bytes'] / 1024:>9.1f} "
+              f"{row['ingest_seconds']:>9.2f} {row['latency_ms_mean']:>8.1f} {row['latency_ms_p95']:>8.1f} "
+              f"{row['prompt_tokens_mean']:>7.0f}" +
+              "".join(f" {row[key]:>12.2f}" for key in quantized_keys))
+
+
+def int_list(value: str) -> List[int]:
+    return [int(v) for v in value.split(",") if v.strip()]
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sweep retrieval settings against a labelled corpus")
+    parser.add_argument("fixtures", help="JSON file with documents and question/answer labels")
+    parser.add_argument("--chunk-sizes", type=int_list, default=[CHUNK_SIZE])
+    parser.add_argument("--overlaps", type=int_list, default=[CHUNK_OVERLAP])
+    parser.add_argument("--n-results", type=int_list, default=[3, 5, 10])
+    parser.add_argument("--per-doc", type=int_list, default=None,
+                        help="search every document with this many results each (collection queries)")
+    parser.add_argument("--quantized", type=lambda value: [v.strip() for v in value.split(",") if v.strip()],
+                        default=None, help="also check recall of these compact vector types (int8, float16)")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    corpus = load_corpus(args.fixtures)
+    rows = sweep(corpus, args.chunk_sizes, args.overlaps, args.n_results, args.per_doc, args.quantized)
+    print_table(rows)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+        print(f"Saved results to {args.json}")
@@ -1,20 +1,61 @@
 import chromadb
 from chromadb.config import Settings
 from sentence_transformers import SentenceTransformer
-from typing import List, Dict
+from collections import OrderedDict
+from typing import List, Dict, Optional
+import numpy as np
+import hashlib
+import os
+import threading
+import uuid
+
+# How much memory loaded document indexes may use before cold ones get evicted
+INDEX_MEMORY_LIMIT_BYTES = int(os.getenv("INDEX_MEMORY_LIMIT_BYTES", str(512 * 1024 * 1024)))
+
+# float32 = search with Chroma as usual
+# float16 / int8 = also keep a compact copy of the vectors and search that instead
+VECTOR_DTYPE = os.getenv("VECTOR_DTYPE", "float32")
+COMPACT_VECTOR_DIR = "./chroma_db/compact"
+
+# The budget is split between Chroma's own cache and our compact indexes, so together they stay under it.
+# With compact vectors Chroma only loads a collection's index for adds/updates, so it gets the smaller share.
+COMPACT_INDEX_MEMORY_BYTES = 0 if VECTOR_DTYPE == "float32" else INDEX_MEMORY_LIMIT_BYTES * 3 // 4
+CHROMA_MEMORY_LIMIT_BYTES = INDEX_MEMORY_LIMIT_BYTES - COMPACT_INDEX_MEMORY_BYTES
+
+# Rows scored at a time by compact_search (keeps the float32 copy small for big documents)
+COMPACT_SEARCH_BLOCK_ROWS = 4096
 
 # Initialize ChromaDB client (persistent storage)
+# LRU policy: Chroma unloads the least recently used collections once over the limit
 chroma_client = chromadb.PersistentClient(
     path="./chroma_db",
-    settings=Settings(anonymized_telemetry=False)
+    settings=Settings(
+        anonymized_telemetry=False,
+        chroma_segment_cache_policy="LRU",
+        chroma_memory_limit_bytes=CHROMA_MEMORY_LIMIT_BYTES
+    )
 )
 
+# Chunking settings (see benchmark_retrieval.py to compare alternatives)
+CHUNK_SIZE = int(os.getenv("CHUNK_SIZE", "1000"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+
+# A chunk can end at half its size (sentence break), so the overlap has to be smaller than that
+if not 0 <= CHUNK_OVERLAP < CHUNK_SIZE // 2:
+    raise ValueError(f"CHUNK_OVERLAP ({CHUNK_OVERLAP}) must be between 0 and half of CHUNK_SIZE ({CHUNK_SIZE})")
+
+# Compact indexes we've loaded for searching, least recently used first
+# doc_id -> {"vectors": count, "bytes": size, "compact": compact index}
+loaded_indexes = OrderedDict()
+# Searches run in several threads - hold this for loaded_indexes and the compact vector files
+index_lock = threading.RLock()
+
 # Initialize embedding model (this converts text to vectors)
 # Using a small, fast model - perfect for our MVP
 embedding_model = SentenceTransformer('all-MiniLM-L6-v2')
 
 
-def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[str]:
+def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """
     Split text into overlapping chunks
     
@@ -40,12 +81,232 @@ def chunk_text(text: str, chunk_size: int = 1000, overlap: int = 200) -> List[st
                 end = start + break_point + 1
         
         chunks.append(chunk.strip())
-        start = end - overlap  # Overlap so we don't lose context
+        # Overlap so we don't lose context - but always move forward
+        start = max(end - overlap, start + 1)
     
     # Filter out tiny chunks
     return [c for c in chunks if len(c.strip()) > 50]
 
 
+def chunk_hash(chunk: str) -> str:
+    """Content hash of a chunk - lets us tell which chunks changed between versions"""
+    return hashlib.sha256(chunk.encode('utf-8')).hexdigest()
+
+
+def quantize(embeddings: np.ndarray, dtype: str) -> Dict:
+    """
+    Shrink float32 vectors: float16 halves the size, int8 quarters it
+    (int8 keeps one float32 scale per vector so we can undo it)
+    """
+    embeddings = np.asarray(embeddings, dtype=np.float32)
+    if dtype == "float16":
+        return {"values": embeddings.astype(np.float16), "scales": None}
+    if dtype == "int8":
+        scales = np.abs(embeddings).max(axis=1) / 127
+        scales[scales == 0] = 1.0
+        values = np.round(embeddings / scales[:, None]).astype(np.int8)
+        return {"values": values, "scales": scales.astype(np.float32)}
+    raise ValueError(f"Unsupported vector dtype: {dtype}")
+
+
+def build_compact_index(ids: List[str], values: np.ndarray, scales: Optional[np.ndarray]) -> Dict:
+    """Quantized vectors + their norms, ready for cosine search"""
+    vectors = values.astype(np.float32)
+    if scales is not None:
+        vectors *= scales[:, None]
+    norms = np.linalg.norm(vectors, axis=1).astype(np.float32) if len(vectors) else np.zeros(0, dtype=np.float32)
+    return {
+        "ids": list(ids),
+        "values": values,
+        "scales": scales,
+        "norms": norms,
+        "nbytes": values.nbytes + norms.nbytes + (scales.nbytes if scales is not None else 0)
+    }
+
+
+def compact_search(index: Dict, query_embedding: List[float], n_results: int) -> List[tuple]:
+    """Brute-force cosine search over a compact index - returns [(chunk_id, similarity)]"""
+    if not index["ids"]:
+        return []
+    query = np.asarray(query_embedding, dtype=np.float32)
+    values = index["values"]
+    scores = np.empty(len(values), dtype=np.float32)
+    # Convert a block at a time instead of making a float32 copy of the whole index per query
+    for start in range(0, len(values), COMPACT_SEARCH_BLOCK_ROWS):
+        block = values[start:start + COMPACT_SEARCH_BLOCK_ROWS]
+        scores[start:start + len(block)] = block.astype(np.float32) @ query
+    if index["scales"] is not None:
+        scores *= index["scales"]
+    scores /= np.maximum(index["norms"] * np.linalg.norm(query), 1e-12)
+
+    top = np.argsort(-scores)[:n_results]
+    return [(index["ids"][i], float(scores[i])) for i in top]
+
+
+def compact_vector_path(doc_id: str) -> str:
+    return os.path.join(COMPACT_VECTOR_DIR, f"{doc_id}.npz")
+
+
+def _read_compact_vectors(doc_id: str) -> Optional[Dict]:
+    """The stored compact vectors, or None if there aren't any in the current VECTOR_DTYPE"""
+    path = compact_vector_path(doc_id)
+    if not os.path.exists(path):
+        return None
+    with np.load(path) as data:
+        if data["values"].dtype != np.dtype(VECTOR_DTYPE):
+            return None  # written under a different VECTOR_DTYPE
+        return {
+            "ids": data["ids"].tolist(),
+            "values": data["values"],
+            "scales": data["scales"] if VECTOR_DTYPE == "int8" else None
+        }
+
+
+def _write_compact_vectors(doc_id: str, ids: List[str], values: np.ndarray, scales: Optional[np.ndarray]):
+    os.makedirs(COMPACT_VECTOR_DIR, exist_ok=True)
+    # Write next to it and swap in, so a reader never sees half a file
+    temp_path = compact_vector_path(doc_id) + ".tmp.npz"
+    np.savez(
+        temp_path,
+        ids=np.array(ids),
+        values=values,
+        scales=scales if scales is not None else np.zeros(0, dtype=np.float32)
+    )
+    os.replace(temp_path, compact_vector_path(doc_id))
+
+
+def save_compact_vectors(doc_id: str, ids: List[str], embeddings: List[List[float]]):
+    """Write the compact copy of a new document's vectors (only when VECTOR_DTYPE isn't float32)"""
+    with index_lock:
+        loaded_indexes.pop(doc_id, None)
+        if VECTOR_DTYPE == "float32" or not ids:
+            return
+        compact = quantize(embeddings, VECTOR_DTYPE)
+        _write_compact_vectors(doc_id, ids, compact["values"], compact["scales"])
+
+
+def patch_compact_vectors(doc_id: str, added_ids: List[str], added_embeddings: List[List[float]],
+                          removed_ids: List[str]):
+    """
+    Apply a document update to its compact vectors - only the changed chunks are touched
+    (int8 scales are per vector, so the untouched rows stay valid)
+    """
+    with index_lock:
+        loaded_indexes.pop(doc_id, None)  # whatever was loaded is stale now
+        if VECTOR_DTYPE == "float32":
+            return
+
+        stored = _read_compact_vectors(doc_id)
+        if stored is None:
+            # Nothing to patch - load_index rebuilds it from Chroma when it's next searched
+            return
+
+        removed = set(removed_ids)
+        keep = [i for i, chunk_id in enumerate(stored["ids"]) if chunk_id not in removed]
+        ids = [stored["ids"][i] for i in keep]
+        values = stored["values"][keep]
+        scales = stored["scales"][keep] if stored["scales"] is not None else None
+
+        if added_ids:
+            added = quantize(added_embeddings, VECTOR_DTYPE)
+            ids += added_ids
+            values = np.concatenate([values, added["values"]])
+            if scales is not None:
+                scales = np.concatenate([scales, added["scales"]])
+
+        _write_compact_vectors(doc_id, ids, values, scales)
+
+
+def load_index(doc_id: str, collection) -> Optional[Dict]:
+    """
+    Load a document's compact vectors (or mark them as recently used)
+    Evicts the coldest compact indexes once we're over COMPACT_INDEX_MEMORY_BYTES
+    Returns the compact index, or None if we should search with Chroma
+    """
+    if VECTOR_DTYPE == "float32":
+        return None  # Chroma loads and evicts these itself
+
+    with index_lock:
+        if doc_id in loaded_indexes:
+            loaded_indexes.move_to_end(doc_id)
+            return loaded_indexes[doc_id]["compact"]
+
+        stored = _read_compact_vectors(doc_id)
+        if stored is None:
+            # Missing or written with another dtype - rebuild it once from Chroma
+            everything = collection.get(include=["embeddings"])
+            if everything['ids']:
+                stored = {"ids": everything['ids'], **quantize(everything['embeddings'], VECTOR_DTYPE)}
+                _write_compact_vectors(doc_id, stored["ids"], stored["values"], stored["scales"])
+            else:
+                stored = {"ids": [], "values": np.zeros((0, 0), dtype=VECTOR_DTYPE), "scales": None}
+        compact = build_compact_index(stored["ids"], stored["values"], stored["scales"])
+        loaded_indexes[doc_id] = {"vectors": len(compact["ids"]), "bytes": compact["nbytes"], "compact": compact}
+
+        while len(loaded_indexes) > 1 and \
+                sum(index["bytes"] for index in loaded_indexes.values()) > COMPACT_INDEX_MEMORY_BYTES:
+            evicted, _ = loaded_indexes.popitem(last=False)
+            print(f"Evicted compact index for {evicted} from memory")
+
+        return compact
+
+
+def index_memory_report() -> Dict:
+    """
+    How the index memory budget is split, and what each loaded compact index is using
+    Chroma doesn't expose which collections it has loaded, so for its cache we only know the limit
+    """
+    with index_lock:
+        return {
+            "vector_dtype": VECTOR_DTYPE,
+            "limit_bytes": INDEX_MEMORY_LIMIT_BYTES,
+            "chroma_limit_bytes": CHROMA_MEMORY_LIMIT_BYTES,
+            "compact_limit_bytes": COMPACT_INDEX_MEMORY_BYTES,
+            "compact_bytes": sum(index["bytes"] for index in loaded_indexes.values()),
+            "compact_indexes": [
+                {"doc_id": doc_id, "vectors": index["vectors"], "bytes": index["bytes"]}
+                for doc_id, index in loaded_indexes.items()
+            ]
+        }
+
+
+def quantized_recall(collection, query_embeddings: List[List[float]], dtype: str, n_results: int) -> Dict:
+    """
+    How much do we lose by storing a collection's vectors as float16/int8?
+    Compares the top results of a compact index against Chroma's float32 search
+    recall = fraction of float32 top results the compact index also finds
+    """
+    stored = collection.get(include=["embeddings"])
+    if not stored['ids']:
+        return {"dtype": dtype, "recall": 1.0, "float32_bytes": 0, "compact_bytes": 0}
+    compact = quantize(stored['embeddings'], dtype)
+    index = build_compact_index(stored['ids'], compact["values"], compact["scales"])
+
+    n_results = min(n_results, len(stored['ids']))
+    exact = collection.query(query_embeddings=query_embeddings, n_results=n_results)
+
+    hits, total = 0, 0
+    for i, query_embedding in enumerate(query_embeddings):
+        expected = set(exact['ids'][i])
+        found = {chunk_id for chunk_id, _ in compact_search(index, query_embedding, n_results)}
+        hits += len(expected & found)
+        total += len(expected)
+
+    return {
+        "dtype": dtype,
+        "recall": hits / total if total else 1.0,
+        "float32_bytes": len(stored['ids']) * len(stored['embeddings'][0]) * 4,
+        "compact_bytes": index["nbytes"]
+    }
+
+
+def check_quantized_recall(doc_id: str, queries: List[str], dtype: str = "int8", n_results: int = 5) -> Dict:
+    """quantized_recall for one stored document (benchmark_retrieval.py --quantized does this for a corpus)"""
+    collection = chroma_client.get_collection(name=f"doc_{doc_id}")
+    query_embeddings = embedding_model.encode(queries).tolist()
+    return {**quantized_recall(collection, query_embeddings, dtype, n_results), "queries": len(queries)}
+
+
 def create_embeddings(doc_id: str, text: str) -> Dict:
     """
     Main function: Takes text, chunks it, creates embeddings, stores in ChromaDB
@@ -74,10 +335,14 @@ def create_embeddings(doc_id: str, text: str) -> Dict:
         embeddings=embeddings,
         documents=chunks,
         ids=[f"{doc_id}_chunk_{i}" for i in range(len(chunks))],
-        metadatas=[{"chunk_index": i, "doc_id": doc_id} for i in range(len(chunks))]
+        metadatas=[
+            {"chunk_index": i, "doc_id": doc_id, "content_hash": chunk_hash(chunk)}
+            for i, chunk in enumerate(chunks)
+        ]
     )
     
     print(f"Stored {len(chunks)} chunks in ChromaDB")
+    save_compact_vectors(doc_id, [f"{doc_id}_chunk_{i}" for i in range(len(chunks))], embeddings)
     
     return {
         "chunks_created": len(chunks),
@@ -86,6 +351,80 @@ def create_embeddings(doc_id: str, text: str) -> Dict:
     }
 
 
+def update_embeddings(doc_id: str, text: str) -> Dict:
+    """
+    Re-ingest a new version of a document into its existing collection
+
+    Instead of re-embedding everything, we diff the new chunks against the
+    stored ones by content hash:
+    - unchanged chunks are kept (only their chunk_index is refreshed)
+    - new/changed chunks are embedded and added
+    - chunks that disappeared are deleted
+
+    So editing a big document costs about as much as the edit itself.
+    """
+    new_chunks = chunk_text(text)
+
+    collection = chroma_client.get_or_create_collection(
+        name=f"doc_{doc_id}",
+        metadata={"hnsw:space": "cosine"}
+    )
+
+    # Index what's stored right now: hash -> list of chunk ids
+    # (hash the stored text so chunks from before content_hash existed still match)
+    stored = collection.get(include=["documents"])
+    stored_by_hash = {}
+    for chunk_id, chunk in zip(stored['ids'], stored['documents']):
+        stored_by_hash.setdefault(chunk_hash(chunk), []).append(chunk_id)
+
+    kept_ids, kept_metadatas = [], []
+    added_chunks, added_metadatas = [], []
+
+    for i, chunk in enumerate(new_chunks):
+        content_hash = chunk_hash(chunk)
+        metadata = {"chunk_index": i, "doc_id": doc_id, "content_hash": content_hash}
+
+        if stored_by_hash.get(content_hash):
+            # Same text is already embedded - reuse it
+            kept_ids.append(stored_by_hash[content_hash].pop())
+            kept_metadatas.append(metadata)
+        else:
+            added_chunks.append(chunk)
+            added_metadatas.append(metadata)
+
+    # Anything left over wasn't matched by the new version
+    removed_ids = [chunk_id for ids in stored_by_hash.values() for chunk_id in ids]
+
+    if removed_ids:
+        collection.delete(ids=removed_ids)
+
+    if kept_ids:
+        collection.update(ids=kept_ids, metadatas=kept_metadatas)
+
+    added_ids, embeddings = [], []
+    if added_chunks:
+        print(f"Embedding {len(added_chunks)} new/changed chunks...")
+        embeddings = embedding_model.encode(added_chunks).tolist()
+        added_ids = [f"{doc_id}_chunk_{uuid.uuid4().hex[:12]}" for _ in added_chunks]
+        collection.add(
+            embeddings=embeddings,
+            documents=added_chunks,
+            ids=added_ids,
+            metadatas=added_metadatas
+        )
+
+    print(f"Updated document {doc_id}: {len(added_chunks)} added, "
+          f"{len(removed_ids)} removed, {len(kept_ids)} unchanged")
+    patch_compact_vectors(doc_id, added_ids, embeddings, removed_ids)
+
+    return {
+        "chunks_total": len(new_chunks),
+        "chunks_added": len(added_chunks),
+        "chunks_removed": len(removed_ids),
+        "chunks_unchanged": len(kept_ids)
+    }
+
+
 def search_document(doc_id: str, query: str, n_results: int = 5) -> List[Dict]:
     """
     Search for relevant chunks in a document
@@ -99,6 +438,23 @@ def search_document(doc_id: str, query: str, n_results: int = 5) -> List[Dict]:
         # Convert query to embedding
         query_embedding = embedding_model.encode([query]).tolist()
         
+        # Compact (float16/int8) vectors? Search those and just fetch the text from Chroma
+        compact = load_index(doc_id, collection)
+        if compact is not None:
+            matches = compact_search(compact, query_embedding[0], n_results)
+            if not matches:
+                return []
+            found = collection.get(ids=[chunk_id for chunk_id, _ in matches], include=["documents", "metadatas"])
+            by_id = {
+                chunk_id: (doc, metadata)
+                for chunk_id, doc, metadata in zip(found['ids'], found['documents'], found['metadatas'])
+            }
+            return [
+                {"text": by_id[chunk_id][0], "metadata": by_id[chunk_id][1], "similarity_score": score}
+                for chunk_id, score in matches
+                if chunk_id in by_id
+            ]
+        
         # Search! ChromaDB finds the most similar chunks
         results = collection.query(
             query_embeddings=query_embedding,
@@ -1,10 +1,50 @@
 import pypdf
 from docx import Document as DocxDocument
 import pandas as pd
+import math
+import multiprocessing
 import os
-from typing import Tuple
+import queue
+from collections import namedtuple
+from html.parser import HTMLParser
+from typing import Callable, List, Tuple
 
+try:
+    import resource  # memory limits only work on Unix
+except ImportError:
+    resource = None
 
+# Extraction runs in separate worker processes so a bad file can't hang or bloat the API
+EXTRACTOR_WORKERS = int(os.getenv("EXTRACTOR_WORKERS", "2"))
+EXTRACTOR_MAX_JOBS = int(os.getenv("EXTRACTOR_MAX_JOBS", "50"))  # recycle workers after this many files
+EXTRACTOR_MEMORY_LIMIT_MB = int(os.getenv("EXTRACTOR_MEMORY_LIMIT_MB", "1024"))
+EXTRACTOR_TIMEOUT = float(os.getenv("EXTRACTOR_TIMEOUT", "30"))  # seconds, before per-MB cost
+EXTRACTOR_QUEUE_TIMEOUT = float(os.getenv("EXTRACTOR_QUEUE_TIMEOUT", "30"))  # wait for a free worker
+
+# file extension -> how to extract it
+# cost = extra seconds of timeout allowed per MB of file
+Extractor = namedtuple("Extractor", ["func", "file_type", "cost"])
+EXTRACTORS = {}
+
+
+def register_extractor(extensions: List[str], file_type: str, cost: float = 1.0):
+    """
+    Decorator to add support for a file format
+
+    @register_extractor(['.rtf'], 'rtf', cost=2.0)
+    def extract_text_from_rtf(file_path: str) -> str: ...
+
+    The function runs inside a worker process, so it must be a
+    module-level function (workers import it by name).
+    """
+    def decorator(func: Callable[[str], str]):
+        for ext in extensions:
+            EXTRACTORS[ext] = Extractor(func, file_type, cost)
+        return func
+    return decorator
+
+
+@register_extractor(['.pdf'], 'pdf', cost=2.0)
 def extract_text_from_pdf(file_path: str) -> str:
     """Extract text from PDF file"""
     text = ""
@@ -15,13 +55,19 @@ def extract_text_from_pdf(file_path: str) -> str:
     return text
 
 
+@register_extractor(['.docx', '.doc'], 'docx')
 def extract_text_from_docx(file_path: str) -> str:
-    """Extract text from Word document"""
+    """Extract text from Word document (paragraphs, then tables row by row)"""
     doc = DocxDocument(file_path)
     text = "\n".join([paragraph.text for paragraph in doc.paragraphs])
+    
+    for table in doc.tables:
+        rows = [" | ".join(cell.text.strip() for cell in row.cells) for row in table.rows]
+        text += "\n\n" + "\n".join(rows)
     return text
 
 
+@register_extractor(['.xlsx', '.xls'], 'excel', cost=2.0)
 def extract_text_from_excel(file_path: str) -> str:
     """Extract text from Excel file - converts to readable format"""
     df = pd.read_excel(file_path)
@@ -30,6 +76,56 @@ def extract_text_from_excel(file_path: str) -> str:
     return text
 
 
+@register_extractor(['.csv'], 'csv')
+def extract_text_from_csv(file_path: str) -> str:
+    """Extract text from CSV file - same readable format as Excel"""
+    df = pd.read_csv(file_path)
+    return df.to_string()
+
+
+class _HTMLTextParser(HTMLParser):
+    """Collects the visible text of an HTML page"""
+    
+    def __init__(self):
+        super().__init__()
+        self.parts = []
+        self._skip = 0
+    
+    def handle_starttag(self, tag, attrs):
+        if tag in ('script', 'style'):
+            self._skip += 1
+    
+    def handle_endtag(self, tag):
+        if tag in ('script', 'style') and self._skip:
+            self._skip -= 1
+    
+    def handle_data(self, data):
+        if not self._skip and data.strip():
+            self.parts.append(data.strip())
+
+
+@register_extractor(['.html', '.htm'], 'html', cost=0.5)
+def extract_text_from_html(file_path: str) -> str:
+    """Extract visible text from HTML file"""
+    parser = _HTMLTextParser()
+    with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
+        parser.feed(file.read())
+    return "\n".join(parser.parts)
+
+
+@register_extractor(['.pptx'], 'pptx')
+def extract_text_from_pptx(file_path: str) -> str:
+    """Extract text from PowerPoint - every text box, slide by slide"""
+    from pptx import Presentation
+    
+    slides = []
+    for number, slide in enumerate(Presentation(file_path).slides, start=1):
+        texts = [shape.text_frame.text for shape in slide.shapes if shape.has_text_frame]
+        slides.append(f"[Slide {number}]\n" + "\n".join(texts))
+    return "\n\n".join(slides)
+
+
+@register_extractor(['.txt', '.md'], 'text', cost=0.1)
 def extract_text_from_txt(file_path: str) -> str:
     """Extract text from text file"""
     with open(file_path, 'r', encoding='utf-8', errors='ignore') as file:
@@ -37,23 +133,164 @@ def extract_text_from_txt(file_path: str) -> str:
     return text
 
 
+# ==================== WORKER POOL ====================
+
+class ExtractionTimeout(Exception):
+    pass
+
+
+class ExtractorBusy(Exception):
+    """Raised when every worker stays busy for the whole queue timeout - the API turns this into a 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"All extractors are busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+def _worker_main(conn, memory_limit_mb: int):
+    """Runs in the worker process: extract files until told to stop"""
+    if resource and memory_limit_mb:
+        # RLIMIT_DATA counts heap memory, not the shared libraries we've loaded
+        limit = memory_limit_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_DATA, (limit, limit))
+    
+    while True:
+        job = conn.recv()
+        if job is None:
+            return
+        func, file_path = job
+        try:
+            conn.send((True, func(file_path)))
+        except MemoryError:
+            conn.send((False, f"ran out of memory (limit {memory_limit_mb} MB)"))
+        except Exception as e:
+            conn.send((False, str(e)))
+
+
+class _Worker:
+    def __init__(self, memory_limit_mb: int):
+        context = multiprocessing.get_context("spawn")
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main, args=(child_conn, memory_limit_mb), daemon=True)
+        self.process.start()
+        child_conn.close()
+        self.jobs = 0
+    
+    def stop(self):
+        try:
+            self.conn.send(None)
+        except (BrokenPipeError, OSError):
+            pass
+        self.process.join(timeout=1)
+        self.kill()
+    
+    def kill(self):
+        if self.process.is_alive():
+            self.process.kill()
+            self.process.join()
+        self.conn.close()
+
+
+class ExtractorPool:
+    """
+    A few worker processes that do the actual extraction
+
+    - A file that takes too long gets its worker killed (and replaced)
+    - Each worker has a memory limit, so a huge file only kills that worker
+    - Workers are replaced after `max_jobs` files in case a parser library leaks memory
+    - A file that can't get a worker within `queue_timeout` gets ExtractorBusy
+    """
+    
+    def __init__(self, workers: int, max_jobs: int, memory_limit_mb: int, queue_timeout: float):
+        self.max_jobs = max_jobs
+        self.memory_limit_mb = memory_limit_mb
+        self.queue_timeout = queue_timeout
+        self._idle = queue.Queue()
+        for _ in range(workers):
+            self._idle.put(None)  # workers start when first needed
+    
+    def run(self, func: Callable[[str], str], file_path: str, timeout: float) -> str:
+        try:
+            worker = self._idle.get(timeout=self.queue_timeout)
+        except queue.Empty:
+            raise ExtractorBusy(max(1, math.ceil(self.queue_timeout)))
+        
+        # From here on the slot goes back to _idle whatever happens (None = start a worker next time)
+        try:
+            if worker is not None and not worker.process.is_alive():
+                # Died while idle (e.g. the OS killed it) - start a fresh one for this job
+                worker.kill()
+                worker = None
+            if worker is None:
+                worker = _Worker(self.memory_limit_mb)
+            try:
+                worker.conn.send((func, file_path))
+            except (BrokenPipeError, OSError):
+                # Died just now - same thing
+                worker.kill()
+                worker = _Worker(self.memory_limit_mb)
+                worker.conn.send((func, file_path))
+            if not worker.conn.poll(timeout):
+                worker.kill()
+                worker = None
+                raise ExtractionTimeout(f"took longer than {timeout:.0f}s")
+            
+            try:
+                ok, result = worker.conn.recv()
+            except (EOFError, OSError):
+                # The worker died (usually the memory limit)
+                worker.kill()
+                worker = None
+                raise Exception("extractor process crashed")
+            
+            worker.jobs += 1
+            if worker.jobs >= self.max_jobs:
+                worker.stop()
+                worker = None
+            
+            if not ok:
+                raise Exception(result)
+            return result
+        finally:
+            self._idle.put(worker)
+    
+    def shutdown(self):
+        while not self._idle.empty():
+            worker = self._idle.get()
+            if worker:
+                worker.stop()
+
+
+_pool = None
+
+
+def get_extractor_pool() -> ExtractorPool:
+    global _pool
+    if _pool is None:
+        _pool = ExtractorPool(EXTRACTOR_WORKERS, EXTRACTOR_MAX_JOBS, EXTRACTOR_MEMORY_LIMIT_MB,
+                              EXTRACTOR_QUEUE_TIMEOUT)
+    return _pool
+
+
 def extract_text(file_path: str) -> Tuple[str, str]:
     """
     Main function to extract text from any supported file type
+    Runs in the extractor pool, so it can take up to the file's timeout
     Returns: (extracted_text, file_type)
     """
     file_ext = os.path.splitext(file_path)[1].lower()
     
     try:
-        if file_ext == '.pdf':
-            return extract_text_from_pdf(file_path), 'pdf'
-        elif file_ext in ['.docx', '.doc']:
-            return extract_text_from_docx(file_path), 'docx'
-        elif file_ext in ['.xlsx', '.xls']:
-            return extract_text_from_excel(file_path), 'excel'
-        elif file_ext in ['.txt', '.md']:
-            return extract_text_from_txt(file_path), 'text'
-        else:
+        if file_ext not in EXTRACTORS:
             raise ValueError(f"Unsupported file type: {file_ext}")
+        
+        extractor = EXTRACTORS[file_ext]
+        size_mb = os.path.getsize(file_path) / (1024 * 1024)
+        timeout = EXTRACTOR_TIMEOUT + extractor.cost * size_mb
+        
+        text = get_extractor_pool().run(extractor.func, file_path, timeout)
+        return text, extractor.file_type
+    except ExtractorBusy:
+        raise  # not a problem with the file
     except Exception as e:
         raise Exception(f"Error extracting text from {file_ext}: {str(e)}")
\ No newline at end of file
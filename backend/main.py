@@ -1,13 +1,19 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException
+from fastapi import FastAPI, UploadFile, File, HTTPException, BackgroundTasks
+from fastapi.concurrency import run_in_threadpool
 from fastapi.middleware.cors import CORSMiddleware
 from pydantic import BaseModel
-from typing import List, Optional
+from typing import List, Optional, Union
 import uuid
 import os
+import tempfile
 from datetime import datetime
-from file_processor import extract_text
-from embeddings import create_embeddings, search_document
-from rag import query_with_rag, query_multiple_documents
+from file_processor import extract_text, get_extractor_pool, ExtractorBusy
+from embeddings import create_embeddings, update_embeddings, search_document, index_memory_report
+from rag import (
+    query_with_rag, query_multiple_documents, build_document_summary,
+    is_summary_question, forget_pinned_context
+)
+from scheduler import llm_scheduler, llm_threads, SchedulerBusy
 
 app = FastAPI(title="Pythagorean API")
 
@@ -19,6 +25,12 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+
+@app.on_event("shutdown")
+def stop_extractor_workers():
+    get_extractor_pool().shutdown()
+
+
 # Storage
 documents = {}
 collections = {}
@@ -27,6 +39,49 @@ reactions = {}
 comments = {}
 
 
+# ==================== UPLOADS ====================
+
+async def extract_upload(file: UploadFile):
+    """Save an uploaded file to a temp file and extract its text (temp file is always cleaned up)"""
+    # Keep only the extension from the client's filename - it picks the extractor
+    suffix = os.path.splitext(os.path.basename(file.filename or ""))[1]
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=False) as f:
+        f.write(await file.read())
+        temp_path = f.name
+    
+    try:
+        # Extraction runs in a worker process - wait for it without blocking the server
+        return await run_in_threadpool(extract_text, temp_path)
+    finally:
+        os.remove(temp_path)
+
+
+# ==================== SUMMARIES ====================
+
+def start_summary(doc_id: str, text: str, background_tasks: BackgroundTasks):
+    """Throw away any old summary and build a fresh one in the background"""
+    doc = documents[doc_id]
+    doc["summary_version"] = doc.get("summary_version", 0) + 1
+    doc["summary"] = None
+    doc["summary_status"] = "pending"
+    background_tasks.add_task(summarize_document, doc_id, text, doc["summary_version"])
+
+
+def summarize_document(doc_id: str, text: str, version: int):
+    try:
+        summary = build_document_summary(doc_id, text)
+        status = "ready"
+    except Exception as e:
+        print(f"Summary error for {doc_id}: {e}")
+        summary, status = None, "failed"
+    
+    # The document may have been re-uploaded while we were working
+    doc = documents.get(doc_id)
+    if doc and doc.get("summary_version") == version:
+        doc["summary"] = summary
+        doc["summary_status"] = status
+
+
 # ==================== MODELS ====================
 
 class SearchRequest(BaseModel):
@@ -67,7 +122,9 @@ async def health_check():
         "status": "healthy", 
         "documents_count": len(documents),
         "collections_count": len(collections),
-        "conversations_count": len(conversations)
+        "conversations_count": len(conversations),
+        "llm_scheduler": {**llm_scheduler.stats(), "threads": llm_threads.stats()},
+        "vector_indexes": index_memory_report()
     }
 
 
@@ -89,21 +146,18 @@ async def create_collection():
 
 @app.post("/upload")
 async def upload_file(
+    background_tasks: BackgroundTasks,
     file: UploadFile = File(...), 
-    collection_id: Optional[str] = None
+    collection_id: Optional[str] = None,
+    summarize: bool = False
 ):
     try:
         doc_id = str(uuid.uuid4())[:8]
         
-        temp_path = f"/tmp/{doc_id}_{file.filename}"
-        with open(temp_path, "wb") as f:
-            content = await file.read()
-            f.write(content)
-        
-        extracted_text, file_type = extract_text(temp_path)
-        os.remove(temp_path)
+        extracted_text, file_type = await extract_upload(file)
         
-        embedding_info = create_embeddings(doc_id, extracted_text)
+        # Embedding is CPU-heavy - keep it off the event loop
+        embedding_info = await run_in_threadpool(create_embeddings, doc_id, extracted_text)
         
         documents[doc_id] = {
             "id": doc_id,
@@ -116,6 +170,9 @@ async def upload_file(
         if collection_id and collection_id in collections:
             collections[collection_id]["documents"].append(doc_id)
         
+        if summarize:
+            start_summary(doc_id, extracted_text, background_tasks)
+        
         return {
             "link_id": doc_id,
             "collection_id": collection_id,
@@ -126,6 +183,8 @@ async def upload_file(
             "message": "File processed and ready for questions!"
         }
         
+    except ExtractorBusy as e:
+        raise busy_response(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -157,6 +216,53 @@ async def get_document(link_id: str):
     return documents[link_id]
 
 
+@app.put("/document/{link_id}")
+async def update_document(
+    link_id: str,
+    background_tasks: BackgroundTasks,
+    file: UploadFile = File(...)
+):
+    """
+    Upload a new version of a document, keeping the same link
+    Only chunks that actually changed get re-embedded
+    """
+    if link_id not in documents:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    try:
+        extracted_text, file_type = await extract_upload(file)
+        
+        # Embedding is CPU-heavy - keep it off the event loop
+        update_info = await run_in_threadpool(update_embeddings, link_id, extracted_text)
+        
+        documents[link_id].update({
+            "filename": file.filename,
+            "file_type": file_type,
+            "chunks": update_info["chunks_total"],
+            "updated_at": datetime.now().isoformat()
+        })
+        
+        # Conversations shouldn't keep answering from the old version
+        forget_pinned_context(link_id)
+        
+        # The old summary describes the old version
+        if documents[link_id].get("summary_status"):
+            start_summary(link_id, extracted_text, background_tasks)
+        
+        return {
+            "link_id": link_id,
+            "filename": file.filename,
+            "file_type": file_type,
+            **update_info,
+            "message": "Document updated!"
+        }
+        
+    except ExtractorBusy as e:
+        raise busy_response(e)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+
 # ==================== QUERY ENDPOINTS ====================
 
 @app.post("/search")
@@ -186,20 +292,39 @@ async def query(request: QueryRequest):
     
     if request.link_id in collections:
         result = await query_collection(request)
+    elif request.link_id in documents and documents[request.link_id].get("summary") \
+            and not request.conversation_history and is_summary_question(request.question):
+        # Precomputed at upload time - no need to ask Claude again
+        # (follow-ups like "summarize that" depend on the conversation, so they still use RAG)
+        result = {
+            "answer": documents[request.link_id]["summary"],
+            "sources": [],
+            "link_id": request.link_id,
+            "type": "document"
+        }
     elif request.link_id in documents:
         try:
-            answer, sources = query_with_rag(
+            # Runs in a dedicated LLM thread so waiting for a slot doesn't block the server
+            answer, sources, usage = await llm_threads.run(
+                request.link_id,
+                query_with_rag,
                 request.link_id,
                 request.question,
-                request.conversation_history
+                request.conversation_history,
+                # Only pin context for conversations the client is continuing -
+                # one-off questions would just push real conversations out
+                request.conversation_id
             )
             
             result = {
                 "answer": answer,
                 "sources": sources,
+                "usage": usage,
                 "link_id": request.link_id,
                 "type": "document"
             }
+        except SchedulerBusy as e:
+            raise busy_response(e)
         except Exception as e:
             raise HTTPException(status_code=500, detail=f"Error querying document: {str(e)}")
     else:
@@ -231,6 +356,15 @@ async def query(request: QueryRequest):
     return result
 
 
+def busy_response(e: Union[SchedulerBusy, ExtractorBusy]) -> HTTPException:
+    """Too much traffic right now (LLM or extraction) - clean 503 instead of a 500"""
+    return HTTPException(
+        status_code=503,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)}
+    )
+
+
 async def query_collection(request: QueryRequest):
     collection = collections[request.link_id]
     doc_ids = collection["documents"]
@@ -239,20 +373,26 @@ async def query_collection(request: QueryRequest):
         raise HTTPException(status_code=400, detail="Collection is empty")
     
     try:
-        answer, sources = query_multiple_documents(
+        answer, sources, usage = await llm_threads.run(
+            request.link_id,
+            query_multiple_documents,
             doc_ids,
             request.question,
-            request.conversation_history
+            request.conversation_history,
+            request.link_id
         )
         
         return {
             "answer": answer,
             "sources": sources,
+            "usage": usage,
             "link_id": request.link_id,
             "type": "collection",
             "document_count": len(doc_ids)
         }
         
+    except SchedulerBusy as e:
+        raise busy_response(e)
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error querying collection: {str(e)}")
 
@@ -1,9 +1,13 @@
-from anthropic import Anthropic
+from anthropic import Anthropic, RateLimitError
 import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from dotenv import load_dotenv
 from typing import List, Tuple, Dict
-from embeddings import search_document
-from typing import List, Tuple, Dict
+from embeddings import search_document, chunk_text
+from scheduler import llm_scheduler, SchedulerBusy
 
 # Load environment variables
 load_dotenv()
@@ -11,8 +15,105 @@ load_dotenv()
 # Initialize Anthropic client
 client = Anthropic(api_key=os.getenv("ANTHROPIC_API_KEY"))
 
+# How many chunks go into a prompt (see benchmark_retrieval.py to compare alternatives)
+RAG_N_RESULTS = int(os.getenv("RAG_N_RESULTS", "5"))
+COLLECTION_N_RESULTS_PER_DOC = int(os.getenv("COLLECTION_N_RESULTS_PER_DOC", "3"))
+COLLECTION_N_RESULTS = int(os.getenv("COLLECTION_N_RESULTS", "10"))
+
+# Summaries: how big each "map" section is, how many sections get
+# summarized at once, and how many partial summaries get merged per "reduce" call
+SUMMARY_SECTION_SIZE = 8000
+SUMMARY_MAX_WORKERS = int(os.getenv("SUMMARY_MAX_WORKERS", "4"))
+SUMMARY_REDUCE_BATCH = 10
+
+# Only questions that ask about the WHOLE document - the entire question has to match,
+# so "summarize section 4" or "what does the executive summary say" still go through RAG
+SUMMARY_QUESTION_PATTERN = re.compile(
+    r"(please\s+)?((can|could|would) you\s+)?"
+    r"(summari[sz]e|give me (a summary|an overview) of|tl;?dr( of)?)"
+    r"(\s+(it|this|(this|the)(\s+(whole|entire))?\s+(document|file|doc|pdf)))?(\s+please)?"
+    r"|what('s|\s+is)\s+(this|the)\s+(document|file|doc|pdf)\s+about"
+    r"|summary|overview|tl;?dr",
+    re.IGNORECASE
+)
+
 
-def query_with_rag(doc_id: str, question: str, conversation_history: List[Dict] = None) -> Tuple[str, List[str]]:
+RAG_SYSTEM_RULES = """You are a helpful AI assistant that answers questions based on the provided document context.
+
+Rules:
+- Answer ONLY based on the context provided
+- If the context doesn't contain the answer, say so clearly
+- Cite your sources (e.g., "According to Source 1...")
+- Be concise but complete
+- If you're not sure, say so"""
+
+# Context pinned to each conversation: "doc_id:conversation_id" -> chunks
+# Least recently used conversations are dropped once we hit the limit
+pinned_contexts = OrderedDict()
+pinned_contexts_lock = threading.Lock()  # queries run in several threads at once
+MAX_PINNED_CONVERSATIONS = 1000
+
+
+def ask_claude(link_id: str, timeout=-1, **request):
+    """
+    Every call to Claude goes through here so the scheduler can share
+    the rate limit fairly between links (timeout=None waits forever)
+    """
+    # Rough token estimate (~4 characters per token) + the most we'll get back
+    prompt_chars = len(str(request.get("system", ""))) + len(str(request.get("messages", "")))
+    estimated_tokens = prompt_chars // 4 + request.get("max_tokens", 0)
+
+    with llm_scheduler.slot(link_id, estimated_tokens, timeout=timeout) as usage:
+        try:
+            response = client.messages.create(**request)
+        except RateLimitError as e:
+            # Upstream is overloaded too - tell the caller when to come back
+            retry_after = e.response.headers.get("retry-after", "")
+            raise SchedulerBusy(int(float(retry_after)) if retry_after else 10)
+        usage.report(response.usage.input_tokens + response.usage.output_tokens)
+    return response
+
+
+def get_pinned_context(doc_id: str, conversation_id: str, chunks: List[Dict]) -> List[Dict]:
+    """Chunks pinned to this conversation (pins `chunks` if this is the first turn)"""
+    if not conversation_id:
+        return chunks
+    
+    key = f"{doc_id}:{conversation_id}"
+    with pinned_contexts_lock:
+        if key in pinned_contexts:
+            pinned_contexts.move_to_end(key)
+        else:
+            if len(pinned_contexts) >= MAX_PINNED_CONVERSATIONS:
+                pinned_contexts.popitem(last=False)
+            pinned_contexts[key] = chunks
+        return pinned_contexts[key]
+
+
+def forget_pinned_context(doc_id: str):
+    """Drop pinned context for a document (e.g. after it's been re-uploaded)"""
+    with pinned_contexts_lock:
+        for key in [k for k in pinned_contexts if k.startswith(f"{doc_id}:")]:
+            del pinned_contexts[key]
+
+
+def usage_report(response) -> Dict:
+    """Token usage for one Claude call, split into cached vs uncached input"""
+    usage = response.usage
+    return {
+        "input_tokens": usage.input_tokens,
+        "cache_read_input_tokens": getattr(usage, "cache_read_input_tokens", None) or 0,
+        "cache_creation_input_tokens": getattr(usage, "cache_creation_input_tokens", None) or 0,
+        "output_tokens": usage.output_tokens
+    }
+
+
+def query_with_rag(
+    doc_id: str,
+    question: str,
+    conversation_history: List[Dict] = None,
+    conversation_id: str = None
+) -> Tuple[str, List[str], Dict]:
     """
     RAG Pipeline: Retrieval-Augmented Generation
     
@@ -20,42 +121,60 @@ def query_with_rag(doc_id: str, question: str, conversation_history: List[Dict]
     2. Send them to Claude with the question
     3. Claude generates an answer based on the context
     
-    Returns: (answer, source_chunks)
+    The prompt is split into a stable prefix (rules + the context pinned on the
+    conversation's first turn) that Claude can cache across turns, and a
+    variable suffix (newly retrieved chunks + the question).
+    
+    Returns: (answer, source_chunks, token_usage)
     """
     
     # Step 1: RETRIEVE - Get relevant chunks using vector search
     print(f"Searching for relevant chunks for: {question}")
-    chunks = search_document(doc_id, question, n_results=5)
+    chunks = search_document(doc_id, question, n_results=RAG_N_RESULTS)
     
     if not chunks:
-        return "I couldn't find any relevant information in the document to answer your question.", []
+        return "I couldn't find any relevant information in the document to answer your question.", [], {}
     
     print(f"Found {len(chunks)} relevant chunks")
     
-    # Step 2: BUILD CONTEXT - Format chunks for Claude
-    context = "\n\n".join([
+    # Step 2: PIN CONTEXT - The first turn's chunks stay in the prefix for the whole conversation
+    pinned = get_pinned_context(doc_id, conversation_id, chunks)
+    pinned_texts = {chunk['text'] for chunk in pinned}
+    extra = [chunk for chunk in chunks if chunk['text'] not in pinned_texts]
+    
+    # Step 3: BUILD CONTEXT - Format chunks for Claude
+    pinned_context = "\n\n".join([
         f"[Source {i+1}]:\n{chunk['text']}"
-        for i, chunk in enumerate(chunks)
+        for i, chunk in enumerate(pinned)
+    ])
+    extra_context = "\n\n".join([
+        f"[Source {len(pinned)+i+1}]:\n{chunk['text']}"
+        for i, chunk in enumerate(extra)
     ])
     
-    # Step 3: BUILD PROMPT - Create the prompt for Claude
-    system_prompt = """You are a helpful AI assistant that answers questions based on the provided document context.
-
-Rules:
-- Answer ONLY based on the context provided
-- If the context doesn't contain the answer, say so clearly
-- Cite your sources (e.g., "According to Source 1...")
-- Be concise but complete
-- If you're not sure, say so"""
+    # Step 4: BUILD PROMPT - Stable prefix goes in the system prompt, marked cacheable
+    system_prompt = [
+        {"type": "text", "text": RAG_SYSTEM_RULES},
+        {
+            "type": "text",
+            "text": f"DOCUMENT CONTEXT:\n{pinned_context}",
+            "cache_control": {"type": "ephemeral"}
+        }
+    ]
 
-    user_message = f"""DOCUMENT CONTEXT:
-{context}
+    if extra_context:
+        user_message = f"""MORE DOCUMENT CONTEXT:
+{extra_context}
 
 USER QUESTION: {question}
 
-Please answer the question based only on the context above."""
+Please answer the question based only on the document context."""
+    else:
+        user_message = f"""USER QUESTION: {question}
 
-    # Step 4: BUILD MESSAGES - Include conversation history if provided
+Please answer the question based only on the document context."""
+
+    # Step 5: BUILD MESSAGES - Include conversation history if provided
     messages = []
     
     if conversation_history:
@@ -72,9 +191,10 @@ Please answer the question based only on the context above."""
         "content": user_message
     })
     
-    # Step 5: GENERATE - Ask Claude!
+    # Step 6: GENERATE - Ask Claude!
     print("Asking Claude...")
-    response = client.messages.create(
+    response = ask_claude(
+        doc_id,
         model="claude-sonnet-4-20250514",
         max_tokens=1024,
         system=system_prompt,
@@ -87,8 +207,75 @@ Please answer the question based only on the context above."""
     # Extract source texts for reference
     sources = [chunk['text'][:200] + "..." for chunk in chunks[:3]]
     
-    print("Got answer from Claude!")
-    return answer, sources
+    usage = usage_report(response)
+    print(f"Got answer from Claude! ({usage['cache_read_input_tokens']} cached input tokens)")
+    return answer, sources, usage
+
+
+def is_summary_question(question: str) -> bool:
+    """Does this question just ask for a summary of the whole document?"""
+    return bool(SUMMARY_QUESTION_PATTERN.fullmatch(question.strip().rstrip("?.! ")))
+
+
+def _summarize_text(doc_id: str, text: str, instruction: str) -> str:
+    """One summarization call to Claude (background work, so it waits its turn as long as needed)"""
+    response = ask_claude(
+        doc_id,
+        timeout=None,
+        model="claude-sonnet-4-20250514",
+        max_tokens=1024,
+        system="You write faithful, concise summaries. Only use information from the text you're given.",
+        messages=[{
+            "role": "user",
+            "content": f"""{instruction}
+
+TEXT:
+{text}"""
+        }]
+    )
+    return response.content[0].text
+
+
+def build_document_summary(doc_id: str, text: str) -> str:
+    """
+    Hierarchical (map-reduce) summary of a whole document
+
+    1. MAP - split into big sections and summarize each one
+       (in parallel, at most SUMMARY_MAX_WORKERS calls at a time)
+    2. REDUCE - merge the section summaries in batches until one is left
+
+    This covers the entire document, unlike a normal RAG query that only sees 5 chunks.
+    """
+    sections = chunk_text(text, chunk_size=SUMMARY_SECTION_SIZE, overlap=0)
+    if not sections:
+        return ""
+
+    print(f"Summarizing {len(sections)} sections...")
+    with ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS) as pool:
+        summaries = list(pool.map(
+            lambda section: _summarize_text(doc_id, section, "Summarize this section of a document."),
+            sections
+        ))
+
+    while len(summaries) > 1:
+        batches = [
+            summaries[i:i + SUMMARY_REDUCE_BATCH]
+            for i in range(0, len(summaries), SUMMARY_REDUCE_BATCH)
+        ]
+        print(f"Merging {len(summaries)} summaries into {len(batches)}...")
+        with ThreadPoolExecutor(max_workers=SUMMARY_MAX_WORKERS) as pool:
+            summaries = list(pool.map(
+                lambda batch: _summarize_text(
+                    doc_id,
+                    "\n\n".join(batch),
+                    "These are summaries of consecutive parts of one document. "
+                    "Combine them into a single summary of the whole document."
+                ),
+                batches
+            ))
+
+    print("Document summary ready!")
+    return summaries[0]
 
 
 def test_rag():
@@ -97,7 +284,7 @@ def test_rag():
     """
     # This is just for testing - you can delete this later
     test_question = "What is this document about?"
-    answer, sources = query_with_rag("test_doc", test_question)
+    answer, sources, usage = query_with_rag("test_doc", test_question)
     print(f"Question: {test_question}")
     print(f"Answer: {answer}")
     print(f"Sources: {sources}")
@@ -105,8 +292,9 @@ def test_rag():
 def query_multiple_documents(
     doc_ids: List[str], 
     question: str, 
-    conversation_history: List[Dict] = None
-) -> Tuple[str, List[str]]:
+    conversation_history: List[Dict] = None,
+    collection_id: str = None
+) -> Tuple[str, List[str], Dict]:
     """
     Query across multiple documents in a collection
     
@@ -114,6 +302,8 @@ def query_multiple_documents(
     1. Search each document
     2. Combine top chunks from all docs
     3. Send to Claude with document labels
+    
+    Returns: (answer, sources, token_usage)
     """
     
     from embeddings import search_document
@@ -124,7 +314,7 @@ def query_multiple_documents(
     
     # Search each document
     for doc_id in doc_ids:
-        chunks = search_document(doc_id, question, n_results=3)  # Get top 3 from each
+        chunks = search_document(doc_id, question, n_results=COLLECTION_N_RESULTS_PER_DOC)  # Get top few from each
         
         # Add document ID to each chunk for citation
         for chunk in chunks:
@@ -132,11 +322,11 @@ def query_multiple_documents(
             all_chunks.append(chunk)
     
     if not all_chunks:
-        return "I couldn't find any relevant information in the documents to answer your question.", []
+        return "I couldn't find any relevant information in the documents to answer your question.", [], {}
     
-    # Sort by similarity score and take top 10
+    # Sort by similarity score and take the best overall
     all_chunks.sort(key=lambda x: x.get('similarity_score', 0), reverse=True)
-    top_chunks = all_chunks[:10]
+    top_chunks = all_chunks[:COLLECTION_N_RESULTS]
     
     # Build context with document labels
     context = "\n\n".join([
@@ -145,6 +335,7 @@ def query_multiple_documents(
     ])
     
     # Build prompt
+    # (no cache breakpoint - the rules alone are far below the minimum cacheable prompt size)
     system_prompt = """You are a helpful AI assistant that answers questions based on multiple documents.
 
 Rules:
@@ -178,7 +369,8 @@ Please answer based on the documents above. Cite which documents you're using.""
     
     # Query Claude
     print("Asking Claude to analyze multiple documents...")
-    response = client.messages.create(
+    response = ask_claude(
+        collection_id or doc_ids[0],
         model="claude-sonnet-4-20250514",
         max_tokens=1024,
         system=system_prompt,
@@ -194,4 +386,4 @@ Please answer based on the documents above. Cite which documents you're using.""
     ]
     
     print("Got multi-document answer from Claude!")
-    return answer, sources
\ No newline at end of file
+    return answer, sources, usage_report(response)
\ No newline at end of file
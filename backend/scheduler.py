@@ -0,0 +1,281 @@
+import asyncio
+import math
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+# Global budget for calls to Claude, shared by every link
+LLM_MAX_CONCURRENT = int(os.getenv("LLM_MAX_CONCURRENT", "8"))
+LLM_TOKENS_PER_MINUTE = int(os.getenv("LLM_TOKENS_PER_MINUTE", "80000"))  # 0 = no token limit
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "30"))
+# How many requests may wait in the fair queue on top of the ones running
+LLM_MAX_WAITING = int(os.getenv("LLM_MAX_WAITING", str(LLM_MAX_CONCURRENT * 4)))
+# How many of those (running + waiting) one link may hold, so other links always find room
+LLM_MAX_PER_LINK = int(os.getenv(
+    "LLM_MAX_PER_LINK", str(max(LLM_MAX_CONCURRENT, (LLM_MAX_CONCURRENT + LLM_MAX_WAITING) // 4))
+))
+
+
+class SchedulerBusy(Exception):
+    """Raised when a request can't get an LLM slot in time - the API turns this into a 503"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(f"LLM is busy, retry in {retry_after}s")
+        self.retry_after = retry_after
+
+
+class _Ticket:
+    def __init__(self, link_id: str, tokens: int, tag: float):
+        self.link_id = link_id
+        self.tokens = tokens
+        self.tag = tag
+        self.enqueued_at = time.monotonic()
+
+
+class FairScheduler:
+    """
+    Admission control in front of Claude
+
+    - At most `max_concurrent` calls run at once
+    - A token bucket keeps us under `tokens_per_minute`
+    - Waiting calls are served by weighted fair queuing across link_ids:
+      each call gets a virtual finish tag (previous tag for its link + tokens / weight)
+      and the smallest tag goes next, so one busy link can't starve the others
+    - Calls that wait longer than the queue timeout get SchedulerBusy
+      (and their link isn't charged for the work that never ran)
+
+    Per-link state is dropped once a link has nothing queued or running.
+    """
+
+    def __init__(self, max_concurrent: int, tokens_per_minute: int, queue_timeout: float):
+        self.max_concurrent = max_concurrent
+        self.tokens_per_minute = tokens_per_minute
+        self.queue_timeout = queue_timeout
+
+        self._cond = threading.Condition()
+        self._active = 0
+        self._waiting = []
+        self._virtual_time = 0.0
+        self._last_tag = {}
+        self._outstanding = {}  # link_id -> calls queued or running
+        self._weights = {}
+
+        self._tokens = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._avg_call_seconds = 5.0
+
+        self._stats = {}
+        self._totals = {"admitted": 0, "timed_out": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0}
+
+    def set_weight(self, link_id: str, weight: float):
+        """Give a link a bigger (or smaller) share of the LLM budget"""
+        with self._cond:
+            self._weights[link_id] = weight
+
+    @contextmanager
+    def slot(self, link_id: str, tokens: int, timeout: Optional[float] = -1):
+        """
+        Wait for our turn, then hold an LLM slot for the duration of the block
+        The block can call `report(actual_tokens)` on the yielded object once usage is known
+        Pass timeout=None to wait as long as it takes (background work)
+        """
+        if timeout == -1:
+            timeout = self.queue_timeout
+
+        ticket = self._admit(link_id, tokens, timeout)
+        started = time.monotonic()
+        try:
+            yield _Usage(self, ticket)
+        finally:
+            self._release(ticket, time.monotonic() - started)
+
+    def stats(self) -> Dict:
+        """Queue wait metrics overall and for links that currently have calls queued or running"""
+        def with_average(s):
+            return {**s, "avg_wait_seconds": round(s["total_wait_seconds"] / s["admitted"], 3) if s["admitted"] else 0.0}
+
+        with self._cond:
+            return {
+                "active": self._active,
+                "queued": len(self._waiting),
+                "max_concurrent": self.max_concurrent,
+                "tokens_available": int(self._tokens) if self.tokens_per_minute else None,
+                "totals": with_average(self._totals),
+                "links": {link_id: with_average(s) for link_id, s in self._stats.items()}
+            }
+
+    def retry_after(self) -> int:
+        """Seconds a rejected caller should wait before trying again"""
+        with self._cond:
+            return self._estimate_retry_after()
+
+    # ---------- internals (call with self._cond held) ----------
+
+    def _admit(self, link_id: str, tokens: int, timeout: Optional[float]) -> _Ticket:
+        with self._cond:
+            weight = self._weights.get(link_id, 1.0)
+            start = max(self._virtual_time, self._last_tag.get(link_id, 0.0))
+            ticket = _Ticket(link_id, tokens, start + tokens / weight)
+            self._last_tag[link_id] = ticket.tag
+            self._outstanding[link_id] = self._outstanding.get(link_id, 0) + 1
+            self._waiting.append(ticket)
+
+            deadline = None if timeout is None else ticket.enqueued_at + timeout
+
+            while True:
+                self._refill()
+                needed = min(tokens, self.tokens_per_minute)
+                is_next = min(self._waiting, key=lambda t: t.tag) is ticket
+
+                if is_next and self._active < self.max_concurrent and \
+                        (not self.tokens_per_minute or self._tokens >= needed):
+                    self._waiting.remove(ticket)
+                    self._active += 1
+                    self._virtual_time = ticket.tag
+                    if self.tokens_per_minute:
+                        self._tokens -= tokens
+                    self._record(link_id, wait=time.monotonic() - ticket.enqueued_at)
+                    self._cond.notify_all()
+                    return ticket
+
+                wait_for = None
+                if is_next and self.tokens_per_minute and self._tokens < needed:
+                    wait_for = (needed - self._tokens) / (self.tokens_per_minute / 60)
+
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._waiting.remove(ticket)
+                        self._record(link_id, timed_out=True)
+                        self._uncharge(ticket, tokens / weight)
+                        self._finished(link_id)
+                        self._cond.notify_all()
+                        raise SchedulerBusy(self._estimate_retry_after())
+                    wait_for = remaining if wait_for is None else min(wait_for, remaining)
+
+                self._cond.wait(wait_for)
+
+    def _release(self, ticket: _Ticket, call_seconds: float):
+        with self._cond:
+            self._active -= 1
+            self._avg_call_seconds = 0.8 * self._avg_call_seconds + 0.2 * call_seconds
+            self._finished(ticket.link_id)
+            self._cond.notify_all()
+
+    def _uncharge(self, ticket: _Ticket, cost: float):
+        # The call never ran - take its virtual time back from the link's later calls
+        for other in self._waiting:
+            if other.link_id == ticket.link_id and other.tag > ticket.tag:
+                other.tag -= cost
+        self._last_tag[ticket.link_id] -= cost
+
+    def _finished(self, link_id: str):
+        self._outstanding[link_id] -= 1
+        if not self._outstanding[link_id]:
+            # Idle links start again from the current virtual time, so there's nothing to keep
+            del self._outstanding[link_id]
+            self._last_tag.pop(link_id, None)
+            self._stats.pop(link_id, None)
+
+    def _refill(self):
+        if not self.tokens_per_minute:
+            return
+        now = time.monotonic()
+        self._tokens = min(
+            float(self.tokens_per_minute),
+            self._tokens + (now - self._last_refill) * self.tokens_per_minute / 60
+        )
+        self._last_refill = now
+
+    def _estimate_retry_after(self) -> int:
+        # Roughly how long until the current queue drains
+        queued = len(self._waiting) + self._active
+        return max(1, math.ceil(self._avg_call_seconds * queued / self.max_concurrent))
+
+    def _record(self, link_id: str, wait: float = 0.0, timed_out: bool = False):
+        link_stats = self._stats.setdefault(link_id, {
+            "admitted": 0, "timed_out": 0, "total_wait_seconds": 0.0, "max_wait_seconds": 0.0
+        })
+        for s in (link_stats, self._totals):
+            if timed_out:
+                s["timed_out"] += 1
+            else:
+                s["admitted"] += 1
+                s["total_wait_seconds"] += wait
+                s["max_wait_seconds"] = max(s["max_wait_seconds"], wait)
+
+
+class _Usage:
+    """Handed out by FairScheduler.slot() so callers can correct the token estimate"""
+
+    def __init__(self, scheduler: FairScheduler, ticket: _Ticket):
+        self._scheduler = scheduler
+        self._ticket = ticket
+
+    def report(self, actual_tokens: int):
+        if not self._scheduler.tokens_per_minute:
+            return
+        with self._scheduler._cond:
+            # Give back (or take) the difference between what we guessed and what we used
+            self._scheduler._tokens += self._ticket.tokens - actual_tokens
+            self._scheduler._cond.notify_all()
+
+
+class LLMThreads:
+    """
+    Threads for request handlers that call Claude (instead of the server's shared threadpool)
+
+    There's one thread per allowed job, so a job always starts right away and
+    waits in the fair queue - where its timeout is running. When every thread
+    is taken we reject immediately rather than letting requests (and uploads
+    sharing the server's threadpool) line up first-come-first-served.
+
+    One link may only hold `max_per_link` threads, so a viral link can't take
+    them all and leave other links nothing but 503s.
+    """
+
+    def __init__(self, size: int, max_per_link: int, scheduler: FairScheduler):
+        self.size = size
+        self.max_per_link = max_per_link
+        self._scheduler = scheduler
+        self._executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="llm")
+        self._lock = threading.Lock()
+        self._in_flight = 0
+        self._per_link = {}
+        self._rejected = 0
+
+    async def run(self, link_id: str, func, *args):
+        with self._lock:
+            if self._in_flight >= self.size or self._per_link.get(link_id, 0) >= self.max_per_link:
+                self._rejected += 1
+                raise SchedulerBusy(self._scheduler.retry_after())
+            self._in_flight += 1
+            self._per_link[link_id] = self._per_link.get(link_id, 0) + 1
+
+        # Counted down when the thread finishes, even if the request was cancelled meanwhile
+        future = self._executor.submit(func, *args)
+        future.add_done_callback(lambda _: self._done(link_id))
+        return await asyncio.wrap_future(future)
+
+    def _done(self, link_id: str):
+        with self._lock:
+            self._in_flight -= 1
+            self._per_link[link_id] -= 1
+            if not self._per_link[link_id]:
+                del self._per_link[link_id]
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "in_flight": self._in_flight,
+                "size": self.size,
+                "max_per_link": self.max_per_link,
+                "rejected": self._rejected
+            }
+
+
+llm_scheduler = FairScheduler(LLM_MAX_CONCURRENT, LLM_TOKENS_PER_MINUTE, LLM_QUEUE_TIMEOUT)
+llm_threads = LLMThreads(LLM_MAX_CONCURRENT + LLM_MAX_WAITING, LLM_MAX_PER_LINK, llm_scheduler)
@@ -0,0 +1,28 @@
+"""
+Extractor functions for the pool tests
+Workers are spawned processes that import these by name, so they can't live in the test file
+"""
+import os
+import time
+
+
+def read(file_path: str) -> str:
+    with open(file_path) as f:
+        return f.read()
+
+
+def worker_pid(file_path: str) -> str:
+    return str(os.getpid())
+
+
+def slow(file_path: str) -> str:
+    time.sleep(60)
+    return "done"
+
+
+def crash(file_path: str) -> str:
+    os._exit(1)
+
+
+def hog_memory(file_path: str) -> str:
+    return str(len(bytearray(2 * 1024 * 1024 * 1024)))
@@ -0,0 +1,72 @@
+import hashlib
+import os
+import random
+import statistics
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import benchmark_retrieval
+
+SAMPLE_CORPUS = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                             "fixtures", "sample_corpus.json")
+
+
+class HashModel:
+    """Deterministic fake embedding model - good enough when the answer can't be missed"""
+
+    def encode(self, texts):
+        return np.array([
+            np.frombuffer(hashlib.sha256(text.encode()).digest()[:8], dtype=np.uint8).astype(np.float32)
+            for text in texts
+        ])
+
+
+def test_sample_corpus_answers_are_in_the_documents(capsys):
+    corpus = benchmark_retrieval.load_corpus(SAMPLE_CORPUS)
+
+    assert set(corpus["texts"]) == {"handbook", "recipe", "release_notes"}
+    assert "Warning" not in capsys.readouterr().out
+
+
+def test_sweep_finds_answers_that_fit_in_one_chunk(monkeypatch):
+    monkeypatch.setattr(benchmark_retrieval, "embedding_model", HashModel())
+    corpus = benchmark_retrieval.load_corpus(SAMPLE_CORPUS)
+
+    rows = benchmark_retrieval.sweep(corpus, chunk_sizes=[1000], overlaps=[0, 200, 600], n_results=[1])
+
+    # overlap 600 is skipped (must be < chunk_size / 2)
+    assert [(row["chunk_size"], row["overlap"]) for row in rows] == [(1000, 0), (1000, 200)]
+    for row in rows:
+        assert row["chunks"] == 3  # each document is a single chunk, so the only result holds the answer
+        assert row["recall"] == 1.0
+        assert row["prompt_tokens_mean"] > 0
+
+
+def test_evaluate_recall_and_latency_percentiles(monkeypatch):
+    # Every other answer is in the retrieved chunk (case and whitespace don't matter)
+    questions = [
+        {"doc_id": "doc", "question": f"question {i}", "answer": "The  answer" if i % 2 == 0 else "not there"}
+        for i in range(20)
+    ]
+    corpus = {"texts": {"doc": "unused"}, "questions": questions}
+    monkeypatch.setattr(benchmark_retrieval, "retrieve",
+                        lambda collections, doc_ids, question, per_doc, n_results: ["Here is the\nanswer."])
+
+    # Each question takes 1..20 ms, in shuffled order
+    latencies_ms = list(range(1, 21))
+    random.Random(0).shuffle(latencies_ms)
+    clock = []
+    for i, ms in enumerate(latencies_ms):
+        clock += [i * 1.0, i * 1.0 + ms / 1000]
+    monkeypatch.setattr(benchmark_retrieval, "time", SimpleNamespace(perf_counter=iter(clock).__next__))
+
+    result = benchmark_retrieval.evaluate({"collections": {}}, corpus, n_results=3)
+
+    assert result["recall"] == 0.5
+    assert result["latency_ms_mean"] == pytest.approx(10.5)
+    assert result["latency_ms_p95"] == pytest.approx(19.0)  # sorted[int(0.95 * 19)]
+    assert result["prompt_tokens_mean"] == statistics.mean(
+        benchmark_retrieval.prompt_tokens(["Here is the\nanswer."], q["question"]) for q in questions
+    )
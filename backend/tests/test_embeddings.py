@@ -0,0 +1,194 @@
+import hashlib
+
+import chromadb
+import numpy as np
+import pytest
+from chromadb.config import Settings
+
+import embeddings
+
+
+def test_chunk_text_finishes_with_large_overlap():
+    # Sentence breaks just past the midpoint make each chunk end early
+    text = ("x" * 520 + ". ") * 20
+
+    chunks = embeddings.chunk_text(text, chunk_size=1000, overlap=600)
+
+    assert chunks
+    assert all(len(chunk) <= 1000 for chunk in chunks)
+
+
+def test_chunk_text_covers_the_whole_text():
+    text = " ".join(f"Sentence number {i}." for i in range(500))
+
+    chunks = embeddings.chunk_text(text)
+
+    assert chunks[0].startswith("Sentence number 0.")
+    assert chunks[-1].endswith("Sentence number 499.")
+
+
+# ==================== RE-INGESTION ====================
+
+class CountingModel:
+    """Deterministic fake embedding model that remembers what it was asked to embed"""
+
+    def __init__(self):
+        self.calls = []
+
+    def encode(self, texts):
+        self.calls.append(list(texts))
+        return np.array([
+            np.frombuffer(hashlib.sha256(text.encode()).digest()[:8], dtype=np.uint8).astype(np.float32)
+            for text in texts
+        ])
+
+    def get_sentence_embedding_dimension(self):
+        return 8
+
+
+def paragraph(name):
+    return f"Paragraph {name}: " + f"some text about {name}. " * 5
+
+
+@pytest.fixture
+def store(monkeypatch, tmp_path):
+    """In-memory Chroma + fake model, one chunk per paragraph"""
+    client = chromadb.EphemeralClient(settings=Settings(anonymized_telemetry=False, allow_reset=True))
+    client.reset()
+    model = CountingModel()
+    monkeypatch.setattr(embeddings, "chroma_client", client)
+    monkeypatch.setattr(embeddings, "embedding_model", model)
+    monkeypatch.setattr(embeddings, "VECTOR_DTYPE", "float32")
+    monkeypatch.setattr(embeddings, "COMPACT_VECTOR_DIR", str(tmp_path))
+    monkeypatch.setattr(embeddings, "chunk_text", lambda text: text.split("\n\n"))
+    embeddings.loaded_indexes.clear()
+    return client, model
+
+
+def stored_chunks(client, doc_id):
+    stored = client.get_collection(f"doc_{doc_id}").get(include=["documents", "metadatas"])
+    return {
+        chunk_id: (text, metadata["chunk_index"])
+        for chunk_id, text, metadata in zip(stored['ids'], stored['documents'], stored['metadatas'])
+    }
+
+
+def ids_by_text(chunks):
+    return {text: chunk_id for chunk_id, (text, _) in chunks.items()}
+
+
+def test_update_keeps_unchanged_chunks_and_refreshes_their_index(store):
+    client, model = store
+    a, b, c = paragraph("a"), paragraph("b"), paragraph("c")
+    embeddings.create_embeddings("doc", "\n\n".join([a, b, c]))
+    before = ids_by_text(stored_chunks(client, "doc"))
+
+    info = embeddings.update_embeddings("doc", "\n\n".join([c, a]))
+
+    after = stored_chunks(client, "doc")
+    assert ids_by_text(after) == {c: before[c], a: before[a]}
+    assert after[before[c]][1] == 0
+    assert after[before[a]][1] == 1
+    assert info == {"chunks_total": 2, "chunks_added": 0, "chunks_removed": 1, "chunks_unchanged": 2}
+    assert len(model.calls) == 1  # only the initial upload was embedded
+
+
+def test_update_only_embeds_added_chunks(store):
+    client, model = store
+    a, b, d = paragraph("a"), paragraph("b"), paragraph("d")
+    embeddings.create_embeddings("doc", "\n\n".join([a, b]))
+
+    info = embeddings.update_embeddings("doc", "\n\n".join([a, d, b]))
+
+    assert model.calls[1:] == [[d]]
+    assert info["chunks_added"] == 1
+    assert sorted(text for text, _ in stored_chunks(client, "doc").values()) == sorted([a, b, d])
+
+
+def test_update_handles_duplicate_chunk_texts(store):
+    client, model = store
+    a, b, c = paragraph("a"), paragraph("b"), paragraph("c")
+    embeddings.create_embeddings("doc", "\n\n".join([a, a, b]))
+
+    info = embeddings.update_embeddings("doc", "\n\n".join([a, c, a, a]))
+
+    texts = sorted(text for text, _ in stored_chunks(client, "doc").values())
+    assert texts == sorted([a, a, a, c])
+    # Two copies of `a` were reused, the third copy and `c` are new, `b` is gone
+    assert info == {"chunks_total": 4, "chunks_added": 2, "chunks_removed": 1, "chunks_unchanged": 2}
+    assert model.calls[1:] == [[c, a]]
+
+
+# ==================== COMPACT VECTORS ====================
+
+def cosine(a, b):
+    return float(a @ b / (np.linalg.norm(a) * np.linalg.norm(b)))
+
+
+@pytest.mark.parametrize("dtype, tolerance", [("float16", 1e-3), ("int8", 2e-2)])
+def test_compact_search_scores_match_float32_cosine(monkeypatch, dtype, tolerance):
+    monkeypatch.setattr(embeddings, "COMPACT_SEARCH_BLOCK_ROWS", 16)  # several blocks
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(50, 32)).astype(np.float32) * rng.uniform(0.1, 10, size=(50, 1))
+    query = rng.normal(size=32).astype(np.float32)
+    ids = [f"chunk_{i}" for i in range(50)]
+
+    compact = embeddings.quantize(vectors.tolist(), dtype)
+    index = embeddings.build_compact_index(ids, compact["values"], compact["scales"])
+    results = embeddings.compact_search(index, query.tolist(), n_results=50)
+
+    assert [score for _, score in results] == sorted((score for _, score in results), reverse=True)
+    scores = dict(results)
+    for i, chunk_id in enumerate(ids):
+        assert scores[chunk_id] == pytest.approx(cosine(vectors[i], query), abs=tolerance)
+
+
+@pytest.fixture
+def int8_store(store, monkeypatch):
+    monkeypatch.setattr(embeddings, "VECTOR_DTYPE", "int8")
+    monkeypatch.setattr(embeddings, "COMPACT_INDEX_MEMORY_BYTES", 1024 * 1024)
+    return store
+
+
+def test_patch_keeps_scales_of_untouched_rows(int8_store):
+    # Very different magnitudes, so every row gets its own scale
+    vectors = {name: [scale * (i + 1) for i in range(8)] for name, scale in [("a", 0.01), ("b", 1.0), ("c", 50.0)]}
+    embeddings.save_compact_vectors("doc", list(vectors), list(vectors.values()))
+    before = embeddings._read_compact_vectors("doc")
+
+    added = [-3.0] * 8
+    embeddings.patch_compact_vectors("doc", ["d"], [added], ["b"])
+
+    after = embeddings._read_compact_vectors("doc")
+    assert after["ids"] == ["a", "c", "d"]
+    for name in ("a", "c"):
+        assert after["scales"][after["ids"].index(name)] == before["scales"][before["ids"].index(name)]
+        np.testing.assert_array_equal(after["values"][after["ids"].index(name)],
+                                      before["values"][before["ids"].index(name)])
+    assert after["scales"][2] == pytest.approx(3.0 / 127)
+
+
+def test_dtype_change_rebuilds_compact_vectors_from_chroma(int8_store, monkeypatch):
+    client, model = int8_store
+    embeddings.create_embeddings("doc", "\n\n".join([paragraph("a"), paragraph("b")]))
+    assert embeddings._read_compact_vectors("doc")["values"].dtype == np.int8
+
+    monkeypatch.setattr(embeddings, "VECTOR_DTYPE", "float16")
+    embeddings.loaded_indexes.clear()
+    assert embeddings._read_compact_vectors("doc") is None
+
+    collection = client.get_collection("doc_doc")
+    compact = embeddings.load_index("doc", collection)
+
+    assert compact["values"].dtype == np.float16
+    assert sorted(compact["ids"]) == sorted(collection.get()['ids'])
+    assert embeddings._read_compact_vectors("doc")["values"].dtype == np.float16
+    assert len(model.calls) == 1  # rebuilt from the stored vectors, nothing re-embedded
+
+
+def test_float32_mode_leaves_index_memory_to_chroma(store):
+    client, _ = store
+    embeddings.create_embeddings("doc", paragraph("a"))
+
+    assert embeddings.load_index("doc", client.get_collection("doc_doc")) is None
+    assert embeddings.index_memory_report()["compact_indexes"] == []
@@ -0,0 +1,102 @@
+import threading
+import time
+
+import pytest
+
+import extractor_jobs
+import file_processor
+from file_processor import ExtractorPool, ExtractionTimeout, ExtractorBusy, Extractor
+
+
+@pytest.fixture
+def pool():
+    pool = ExtractorPool(workers=1, max_jobs=50, memory_limit_mb=256, queue_timeout=0.5)
+    yield pool
+    pool.shutdown()
+
+
+@pytest.fixture
+def sample(tmp_path):
+    path = tmp_path / "sample.txt"
+    path.write_text("hello")
+    return str(path)
+
+
+def test_registered_slow_extractor_times_out(monkeypatch, pool, tmp_path):
+    monkeypatch.setitem(file_processor.EXTRACTORS, ".slow", Extractor(extractor_jobs.slow, "slow", 0.0))
+    monkeypatch.setattr(file_processor, "EXTRACTOR_TIMEOUT", 1.0)
+    monkeypatch.setattr(file_processor, "_pool", pool)
+    path = tmp_path / "file.slow"
+    path.write_text("zzz")
+
+    with pytest.raises(Exception, match="took longer than 1s"):
+        file_processor.extract_text(str(path))
+
+    # The stuck worker was killed and the slot freed
+    assert pool.run(extractor_jobs.read, str(path), timeout=10) == "zzz"
+
+
+def test_timeout_kills_the_worker(pool, sample):
+    with pytest.raises(ExtractionTimeout):
+        pool.run(extractor_jobs.slow, sample, timeout=0.5)
+
+    assert pool.run(extractor_jobs.read, sample, timeout=10) == "hello"
+
+
+def test_crashed_worker_is_replaced(pool, sample):
+    with pytest.raises(Exception, match="extractor process crashed"):
+        pool.run(extractor_jobs.crash, sample, timeout=10)
+
+    assert pool.run(extractor_jobs.read, sample, timeout=10) == "hello"
+
+
+def test_memory_limit_stops_a_hungry_extractor(pool, sample):
+    with pytest.raises(Exception, match="memory|crashed"):
+        pool.run(extractor_jobs.hog_memory, sample, timeout=10)
+
+    assert pool.run(extractor_jobs.read, sample, timeout=10) == "hello"
+
+
+def test_workers_are_recycled_after_max_jobs(sample):
+    pool = ExtractorPool(workers=1, max_jobs=2, memory_limit_mb=256, queue_timeout=0.5)
+    try:
+        pids = [pool.run(extractor_jobs.worker_pid, sample, timeout=10) for _ in range(3)]
+    finally:
+        pool.shutdown()
+
+    assert pids[0] == pids[1]
+    assert pids[2] != pids[1]
+
+
+def test_busy_pool_rejects_after_queue_timeout(pool, sample):
+    def stuck_job():
+        with pytest.raises(ExtractionTimeout):
+            pool.run(extractor_jobs.slow, sample, timeout=3)
+
+    # The only worker is stuck on a slow file
+    stuck = threading.Thread(target=stuck_job)
+    stuck.start()
+    deadline = time.monotonic() + 5
+    while pool._idle.qsize() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    try:
+        with pytest.raises(ExtractorBusy) as busy:
+            pool.run(extractor_jobs.read, sample, timeout=10)
+        assert busy.value.retry_after == 1
+    finally:
+        stuck.join()
+
+    assert pool.run(extractor_jobs.read, sample, timeout=10) == "hello"
+
+
+def test_failed_worker_start_frees_the_slot(monkeypatch, pool, sample):
+    def broken_worker(memory_limit_mb):
+        raise OSError("can't start process")
+
+    with monkeypatch.context() as patched:
+        patched.setattr(file_processor, "_Worker", broken_worker)
+        with pytest.raises(OSError):
+            pool.run(extractor_jobs.read, sample, timeout=10)
+
+    # Without the slot back this would be ExtractorBusy
+    assert pool.run(extractor_jobs.read, sample, timeout=10) == "hello"
@@ -0,0 +1,132 @@
+from collections import OrderedDict
+from types import SimpleNamespace
+
+import pytest
+
+import rag
+
+
+@pytest.mark.parametrize("question", [
+    "Summarize this document",
+    "summarise the file.",
+    "Can you summarize it?",
+    "Please give me a summary of the whole document",
+    "What is this document about?",
+    "what's the file about",
+    "TL;DR",
+    "Overview",
+])
+def test_whole_document_questions_are_summary_questions(question):
+    assert rag.is_summary_question(question)
+
+
+@pytest.mark.parametrize("question", [
+    "Summarize section 4 on refunds",
+    "What does the executive summary say about Q3 revenue?",
+    "Give me an overview of the API authentication flow",
+    "Summarize the refund policy",
+    "How many vacation days do employees get?",
+])
+def test_specific_questions_are_not_summary_questions(question):
+    assert not rag.is_summary_question(question)
+
+
+class RecordingMessages:
+    """Stands in for client.messages and remembers every request it gets"""
+
+    def __init__(self):
+        self.requests = []
+
+    def create(self, **request):
+        self.requests.append(request)
+        return SimpleNamespace(
+            content=[SimpleNamespace(text="stub answer")],
+            usage=SimpleNamespace(
+                input_tokens=10, output_tokens=5,
+                cache_read_input_tokens=100, cache_creation_input_tokens=0
+            )
+        )
+
+
+def make_chunks(*texts):
+    return [{"text": text, "metadata": {}, "similarity_score": 0.9} for text in texts]
+
+
+@pytest.fixture
+def stub_claude(monkeypatch):
+    messages = RecordingMessages()
+    monkeypatch.setattr(rag, "client", SimpleNamespace(messages=messages))
+    monkeypatch.setattr(rag, "pinned_contexts", OrderedDict())
+    return messages
+
+
+def test_prompt_keeps_pinned_prefix_across_turns(stub_claude, monkeypatch):
+    turns = iter([
+        make_chunks("alpha chunk", "beta chunk"),
+        make_chunks("beta chunk", "gamma chunk"),
+    ])
+    monkeypatch.setattr(rag, "search_document", lambda doc_id, question, n_results: next(turns))
+
+    _, _, usage = rag.query_with_rag("doc1", "first question?", conversation_id="conv1")
+    rag.query_with_rag("doc1", "second question?", conversation_id="conv1")
+
+    first, second = stub_claude.requests
+
+    # Rules + pinned context are system blocks, with a cache breakpoint on the context
+    assert [block["text"] for block in first["system"]][0] == rag.RAG_SYSTEM_RULES
+    assert first["system"][-1]["cache_control"] == {"type": "ephemeral"}
+    assert "alpha chunk" in first["system"][-1]["text"]
+
+    # The prefix is identical on the second turn...
+    assert second["system"] == first["system"]
+    assert "gamma chunk" not in second["system"][-1]["text"]
+
+    # ...and only the newly retrieved chunk goes in the user message
+    last_message = second["messages"][-1]["content"]
+    assert "gamma chunk" in last_message
+    assert "beta chunk" not in last_message
+    assert "second question?" in last_message
+
+    assert usage["cache_read_input_tokens"] == 100
+
+
+def test_conversations_pin_their_own_context(stub_claude, monkeypatch):
+    turns = iter([make_chunks("alpha chunk"), make_chunks("delta chunk")])
+    monkeypatch.setattr(rag, "search_document", lambda doc_id, question, n_results: next(turns))
+
+    rag.query_with_rag("doc1", "question?", conversation_id="conv1")
+    rag.query_with_rag("doc1", "question?", conversation_id="conv2")
+
+    first, second = stub_claude.requests
+    assert "delta chunk" in second["system"][-1]["text"]
+    assert "alpha chunk" not in second["system"][-1]["text"]
+
+
+def test_forget_pinned_context_drops_only_that_document(stub_claude):
+    rag.get_pinned_context("doc1", "conv1", make_chunks("old"))
+    rag.get_pinned_context("doc2", "conv1", make_chunks("other"))
+
+    rag.forget_pinned_context("doc1")
+
+    assert rag.get_pinned_context("doc1", "conv1", make_chunks("new"))[0]["text"] == "new"
+    assert rag.get_pinned_context("doc2", "conv1", make_chunks("new"))[0]["text"] == "other"
+
+
+def test_pinned_contexts_evict_least_recently_used(stub_claude, monkeypatch):
+    monkeypatch.setattr(rag, "MAX_PINNED_CONVERSATIONS", 2)
+    rag.get_pinned_context("doc1", "busy", make_chunks("busy context"))
+    rag.get_pinned_context("doc1", "one-off", make_chunks("one-off context"))
+
+    # The busy conversation is used again, so the one-off one is evicted first
+    rag.get_pinned_context("doc1", "busy", make_chunks("ignored"))
+    rag.get_pinned_context("doc1", "newcomer", make_chunks("newcomer context"))
+
+    assert list(rag.pinned_contexts) == ["doc1:busy", "doc1:newcomer"]
+
+
+def test_queries_without_conversation_id_pin_nothing(stub_claude, monkeypatch):
+    monkeypatch.setattr(rag, "search_document", lambda doc_id, question, n_results: make_chunks("alpha chunk"))
+
+    rag.query_with_rag("doc1", "question?")
+
+    assert not rag.pinned_contexts
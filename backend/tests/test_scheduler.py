@@ -0,0 +1,210 @@
+import asyncio
+import threading
+import time
+
+import pytest
+
+from scheduler import FairScheduler, LLMThreads, SchedulerBusy
+
+
+def wait_until(condition, timeout=2.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "timed out waiting for condition"
+        time.sleep(0.005)
+
+
+def test_busy_link_does_not_starve_others():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=5)
+    served = []
+
+    def call(link_id):
+        with scheduler.slot(link_id, 100):
+            served.append(link_id)
+
+    with scheduler.slot("viral", 100):
+        threads = []
+        # Queue up a backlog for the busy link, then one call for a quiet link
+        for link_id in ["viral", "viral", "viral", "quiet"]:
+            thread = threading.Thread(target=call, args=(link_id,))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: scheduler.stats()["queued"] == len(threads))
+
+    for thread in threads:
+        thread.join()
+
+    assert served.index("quiet") <= 1
+    assert served.count("viral") == 3
+
+
+def test_weight_gives_a_link_a_bigger_share():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=5)
+    scheduler.set_weight("premium", 4)
+    served = []
+
+    def call(link_id):
+        with scheduler.slot(link_id, 100):
+            served.append(link_id)
+
+    with scheduler.slot("other", 100):
+        threads = []
+        for link_id in ["other", "other", "premium", "premium", "premium"]:
+            thread = threading.Thread(target=call, args=(link_id,))
+            thread.start()
+            threads.append(thread)
+            wait_until(lambda: scheduler.stats()["queued"] == len(threads))
+
+    for thread in threads:
+        thread.join()
+
+    assert served[:3] == ["premium", "premium", "premium"]
+
+
+def test_waiting_too_long_raises_scheduler_busy():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=0.1)
+
+    with scheduler.slot("a", 100):
+        started = time.monotonic()
+        with pytest.raises(SchedulerBusy) as error:
+            with scheduler.slot("b", 100):
+                pass
+
+    assert 0.1 <= time.monotonic() - started < 1
+    assert error.value.retry_after >= 1
+    stats = scheduler.stats()
+    assert stats["queued"] == 0
+    assert stats["totals"]["timed_out"] == 1
+
+
+def test_token_bucket_refills_over_time():
+    scheduler = FairScheduler(max_concurrent=4, tokens_per_minute=600, queue_timeout=5)  # 10 tokens/s
+
+    with scheduler.slot("a", 600):
+        pass
+
+    # The bucket is empty: 5 tokens take about half a second to come back
+    started = time.monotonic()
+    with scheduler.slot("a", 5):
+        pass
+    assert time.monotonic() - started >= 0.4
+
+
+def test_token_bucket_rejects_when_refill_is_too_slow():
+    scheduler = FairScheduler(max_concurrent=4, tokens_per_minute=600, queue_timeout=0.1)
+
+    with scheduler.slot("a", 600):
+        pass
+
+    with pytest.raises(SchedulerBusy):
+        with scheduler.slot("a", 100):
+            pass
+
+
+def test_report_corrects_the_token_estimate():
+    scheduler = FairScheduler(max_concurrent=4, tokens_per_minute=6000, queue_timeout=5)
+
+    with scheduler.slot("a", 1000) as usage:
+        assert scheduler.stats()["tokens_available"] <= 5001
+        usage.report(100)
+
+    # 900 overestimated tokens went back in the bucket
+    assert 5890 <= scheduler.stats()["tokens_available"] <= 6000
+
+
+def test_llm_threads_reject_immediately_when_full():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=5)
+    threads = LLMThreads(1, 1, scheduler)
+    release = threading.Event()
+
+    async def scenario():
+        first = asyncio.ensure_future(threads.run("a", release.wait))
+        await asyncio.sleep(0.05)
+
+        started = time.monotonic()
+        with pytest.raises(SchedulerBusy):
+            await threads.run("b", lambda: None)
+        assert time.monotonic() - started < 0.1
+
+        release.set()
+        await first
+        # The thread is free again
+        assert await threads.run("b", lambda: "ok") == "ok"
+
+    asyncio.run(scenario())
+    assert threads.stats()["rejected"] == 1
+
+
+def test_llm_threads_keep_room_for_other_links():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=5)
+    threads = LLMThreads(4, 2, scheduler)
+    release = threading.Event()
+
+    async def scenario():
+        # The viral link floods the pool but only gets its share of the threads
+        viral = [asyncio.ensure_future(threads.run("viral", release.wait)) for _ in range(4)]
+        await asyncio.sleep(0.05)
+        rejected = [job for job in viral if job.done() and isinstance(job.exception(), SchedulerBusy)]
+        assert len(rejected) == 2
+
+        # The quiet link still gets a thread while the viral jobs are stuck
+        assert await threads.run("quiet", lambda: "answered") == "answered"
+        release.set()
+        await asyncio.gather(*viral, return_exceptions=True)
+
+    try:
+        asyncio.run(scenario())
+    finally:
+        release.set()
+    assert threads.stats()["in_flight"] == 0
+
+
+def test_timed_out_call_is_not_charged_to_its_link():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=5)
+    served = []
+
+    def call(link_id, timeout=-1):
+        try:
+            with scheduler.slot(link_id, 100, timeout=timeout):
+                served.append(link_id)
+        except SchedulerBusy:
+            served.append(f"{link_id} timed out")
+
+    def queue(link_id, timeout=-1):
+        thread = threading.Thread(target=call, args=(link_id, timeout))
+        thread.start()
+        threads.append(thread)
+        return thread
+
+    threads = []
+    with scheduler.slot("x", 100):
+        queue("a")
+        wait_until(lambda: scheduler.stats()["queued"] == 1)
+        # a's second call gives up while x is still running...
+        queue("a", timeout=0.05).join()
+
+        # ...so a's third call is only one call behind, like c's second
+        for link_id in ["a", "c", "c"]:
+            queue(link_id)
+            wait_until(lambda: scheduler.stats()["queued"] == len(threads) - 1)
+
+    for thread in threads:
+        thread.join()
+
+    assert served == ["a timed out", "a", "c", "a", "c"]
+
+
+def test_idle_links_are_forgotten():
+    scheduler = FairScheduler(max_concurrent=1, tokens_per_minute=0, queue_timeout=0.05)
+
+    with scheduler.slot("a", 100):
+        assert "a" in scheduler.stats()["links"]
+        with pytest.raises(SchedulerBusy):
+            with scheduler.slot("b", 100):
+                pass
+
+    stats = scheduler.stats()
+    assert stats["links"] == {}
+    assert stats["totals"]["admitted"] == 1
+    assert stats["totals"]["timed_out"] == 1
+    assert scheduler._last_tag == {}